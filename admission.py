@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import APIRouter, HTTPException, status
+from config import setting
+
+#Every controller registers itself here so its queue depth shows up in `GET /admission`
+controllers: Dict[str, "AdmissionController"] = {}
+
+
+class AdmissionController:
+    """
+    Limit how many requests run at once, queueing the rest by priority (lower runs first).
+
+    Requests are rejected with 503 and `Retry-After` when the queue is full, when the
+    expected wait (from the average time a request holds its slot) already exceeds
+    `max_wait`, or when they actually waited `max_wait` seconds.
+    """
+    def __init__(self, name: str, limit: int, queue_size: int = None, max_wait: float = None):
+        self.name = name
+        self.limit = limit
+        self.queue_size = setting.ADMISSION_QUEUE_SIZE if queue_size is None else queue_size
+        self.max_wait = setting.ADMISSION_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        self.in_flight = 0
+        self.waiters: List[list] = []
+        self.sequence = itertools.count()
+        #Moving average of how long a request holds its slot, in seconds
+        self.service_time = 0.05
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queued = 0
+        controllers[name] = self
+
+    def estimated_wait(self, priority: int) -> float:
+        ahead = sum(1 for waiter in self.waiters if waiter[0] <= priority)
+        return (ahead + 1) * self.service_time / self.limit
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected += 1
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, f"Server is busy ({reason}), please try again later.", headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    async def acquire(self, priority: int = 0):
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        estimate = self.estimated_wait(priority)
+        if len(self.waiters) >= self.queue_size:  self._reject("queue is full", estimate)
+        if estimate > self.max_wait:  self._reject("expected wait is too long", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [priority, next(self.sequence), future]
+        heapq.heappush(self.waiters, waiter)
+        self.max_queued = max(self.max_queued, len(self.waiters))
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                #The slot was handed over in the same loop iteration the timeout fired; give it back
+                self.release()
+            else:
+                self._discard(waiter)
+            self.timed_out += 1
+            self._reject("timed out waiting in queue", self.estimated_wait(priority))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                #The slot was handed over just as we got cancelled
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+
+    def _discard(self, waiter: list):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+            heapq.heapify(self.waiters)
+
+    def release(self, elapsed: Optional[float] = None):
+        if elapsed is not None:
+            self.service_time = 0.9 * self.service_time + 0.1 * elapsed
+        #Hand the slot straight to the next waiter so newcomers can't overtake the queue
+        while self.waiters:
+            *_, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                self.admitted += 1
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self, priority: int = 0):
+        await self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "service_time": round(self.service_time, 4),
+        }
+
+
+#Requests beyond what the connection pool can serve queue here instead of inside the pool
+database_admission = AdmissionController("database", setting.DB_POOL_SIZE + setting.DB_MAX_OVERFLOW)
+
+
+def get_admission_dependency(priority: int, *extra_controllers: AdmissionController):
+    """
+    Dependency that holds an admission slot (per extra controller, then for the database)
+    for the whole request. Add it to a route's `dependencies` so it runs before `get_db`.
+    """
+    async def admit():
+        async with AsyncExitStack() as stack:
+            for controller in (*extra_controllers, database_admission):
+                await stack.enter_async_context(controller.admit(priority))
+            yield
+    return admit
+
+
+router = APIRouter(
+    prefix="/admission",
+    tags=["Admission control"],
+)
+
+@router.get("", summary="Concurrency and queue depth of every admission controller")
+async def admission_stats():
+    return [controller.stats() for controller in controllers.values()]
@@ -1,3 +1,4 @@
+import hashlib
 import uuid
 from fastapi import APIRouter,Depends, Form, HTTPException
 from fastapi.security import OAuth2PasswordBearer
@@ -12,6 +13,7 @@ from database import get_db
 from datetime import datetime,timedelta
 from passlib.context import CryptContext
 from config import setting
+from admission import AdmissionController, get_admission_dependency
 
 
 
@@ -60,6 +62,12 @@ def create_refresh_token(data: dict, expires_delta: timedelta):
     encoded = jwt.encode(to_encode, setting.SECRET_KEY, algorithm=setting.HASH_ALGORITHM)
     return encoded, jti, expire
 
+def get_token_storage_value(token: str) -> str:
+    #Lookups are done by jti, so the stored value is informational only (Django shows it in admin)
+    if setting.TOKEN_STORE_DIGEST:
+        return "sha256:" + hashlib.sha256(token.encode()).hexdigest()
+    return token
+
 def decode_token(token: str):
     return jwt.decode(token, setting.SECRET_KEY, algorithms=[setting.HASH_ALGORITHM])
 
@@ -71,9 +79,12 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 #Authentication endpoints router
+#Logins and refreshes go ahead of every ViewSet request when the database is busy
+auth_admission = AdmissionController("auth", setting.AUTH_CONCURRENCY_LIMIT)
 router = APIRouter(
     prefix="/auth", 
     tags=["Authentication & Autherization"], 
+    dependencies=[Depends(get_admission_dependency(0, auth_admission))],
 )
 
 
@@ -112,7 +123,7 @@ async def login(data: LoginRequest, db: AsyncSession = Depends(get_db)):
 
     db.add(OutstandingToken(
         jti=jti,
-        token=refresh_token,
+        token=get_token_storage_value(refresh_token),
         expires_at=exp,
         user_id=user.id
     ))
@@ -10,23 +10,75 @@ class Settings(BaseSettings):
     HASH_ALGORITHM: str = "HS256"  
     ACCESS_TOKEN_EXPIRE_MINUTES:int = 5
     REFRESH_TOKEN_EXPIRE_DAYS:int = 1
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    #Requests queued for admission beyond these limits are rejected with 503
+    ADMISSION_QUEUE_SIZE: int = 100
+    ADMISSION_MAX_WAIT_SECONDS: float = 5
+    AUTH_CONCURRENCY_LIMIT: int = 10
+    #Log the indexes missing for the registered ViewSets when the app starts
+    INDEX_ADVISOR_ON_STARTUP: bool = False
+    #Default statement timeout for ViewSet routes in milliseconds (0 disables it)
+    DB_STATEMENT_TIMEOUT_MS: int = 0
+    #How often in-flight requests check whether the client is still connected
+    DISCONNECT_POLL_SECONDS: float = 0.5
+    #Store only a sha256 digest of refresh tokens instead of the encoded token
+    TOKEN_STORE_DIGEST: bool = False
+    #Expired tokens are purged every TOKEN_PURGE_INTERVAL_MINUTES (0 disables the background purge)
+    TOKEN_PURGE_INTERVAL_MINUTES: int = 60
+    TOKEN_PURGE_BATCH_SIZE: int = 1000
+    #Change feed events older than CHANGE_FEED_RETENTION_HOURS are purged every CHANGE_FEED_PURGE_INTERVAL_MINUTES
+    #(0 disables the background purge; schedule `maintenance.py purge-changes` instead)
+    CHANGE_FEED_RETENTION_HOURS: int = 24
+    CHANGE_FEED_PURGE_INTERVAL_MINUTES: int = 60
+    CHANGE_FEED_KEEPALIVE_SECONDS: int = 15
+    CHANGE_FEED_QUEUE_SIZE: int = 1000
+    #Ids re-read below the newest delivered event on replay, to catch transactions that committed out of order
+    CHANGE_FEED_REPLAY_WINDOW: int = 100
+    #Replays read the log in pages of CHANGE_FEED_REPLAY_BATCH_SIZE events; past CHANGE_FEED_MAX_REPLAY
+    #missed events the client gets a `reset` event and refetches instead
+    CHANGE_FEED_REPLAY_BATCH_SIZE: int = 100
+    CHANGE_FEED_MAX_REPLAY: int = 1000
     class Config:
          env_file = ".env"
 
 setting = Settings()
 
+import asyncio
+import logging
 from fastapi import FastAPI
 from fastapi.concurrency import asynccontextmanager
 from database import engine, Base,init_db
+import admission
 import authentication
 from routers import test # Import the items router
 from views.user import UserViewSet
+from views.negotiation import install_openapi_components
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):    
     await init_db()  
+    if setting.INDEX_ADVISOR_ON_STARTUP:
+        from index_advisor import advise_indexes, format_report
+        try:
+            missing, needs_trigram = await advise_indexes(views)
+            if missing:  logging.getLogger("index_advisor").warning(format_report(missing, needs_trigram))
+        except Exception:
+            logging.getLogger("index_advisor").exception("Index advisor failed")
+    from maintenance import purge_change_events, purge_expired_tokens, purge_periodically
+    from views.changes import change_feed
+    purge_tasks = []
+    if setting.TOKEN_PURGE_INTERVAL_MINUTES > 0:
+        purge_tasks.append(asyncio.create_task(purge_periodically(purge_expired_tokens, setting.TOKEN_PURGE_INTERVAL_MINUTES * 60, "expired refresh tokens")))
+    if setting.CHANGE_FEED_PURGE_INTERVAL_MINUTES > 0:
+        purge_tasks.append(asyncio.create_task(purge_periodically(purge_change_events, setting.CHANGE_FEED_PURGE_INTERVAL_MINUTES * 60, "change feed events")))
     yield
+    for task in purge_tasks:  task.cancel()
+    #Wait for the purges to stop before the engine they use goes away
+    await asyncio.gather(*purge_tasks, return_exceptions=True)
+    await change_feed.close()
 
 
 # Create the FastAPI app instance
@@ -44,9 +96,11 @@ app.openapi_tags = []
 for view in views:  
     app.openapi_tags += view.openapi_tag_metadata
     app.include_router(view.router)
+install_openapi_components(app, views)
 
 # Include normal routers
 app.include_router(authentication.router)
+app.include_router(admission.router)
 app.include_router(test.router)
 
 @app.get("/")
@@ -1,13 +1,14 @@
 import asyncio
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.orm import sessionmaker,DeclarativeBase
+from sqlalchemy.orm import Session,sessionmaker,DeclarativeBase
 from config import setting 
 
 #We use asyncpg as an asyncronous driver for SQLAlchamy
 SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{setting.DB_USER}:{setting.DB_PASS}@{setting.DB_HOST}:{setting.DB_PORT}/{setting.DB_NAME}"
 
 # Create the SQLAlchemy engine.
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL,echo=False)
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL,echo=False,pool_size=setting.DB_POOL_SIZE,max_overflow=setting.DB_MAX_OVERFLOW,pool_timeout=setting.DB_POOL_TIMEOUT)
 
 # Create a SessionLocal class. Each instance of a SessionLocal class will be a database session.
 # The class itself is not a database session yet.
@@ -18,6 +19,19 @@ SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine
 class Base(DeclarativeBase):
     pass
 
+#Statement timeout (in milliseconds) stored on a session is applied with SET LOCAL to every transaction it begins
+@event.listens_for(Session, "after_begin")
+def apply_statement_timeout(session, transaction, connection):
+    timeout = session.info.get("statement_timeout")
+    if timeout:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+async def set_statement_timeout(db: AsyncSession, timeout: int):
+    db.info["statement_timeout"] = timeout
+    #The transaction may already be open, e.g. by loading the current user
+    if db.in_transaction():
+        await db.execute(text(f"SET LOCAL statement_timeout = {int(timeout)}"))
+
 #DB initializer function
 async def init_db():
     async with engine.begin() as conn:
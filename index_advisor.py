@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import uuid
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Table, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from database import engine
+from models.change import ChangeEvent
+from models.token import BlacklistedToken, OutstandingToken
+from models.user import User, user_group_table
+
+TRIGRAM_OPCLASSES = {"gin_trgm_ops", "gist_trgm_ops"}
+ALEMBIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic")
+
+
+class IndexRequirement:
+    """
+    An index some query relies on: a B-tree on `columns` (they must be a prefix of an
+    existing B-tree index), or a trigram GIN index for `ILIKE '%...%'` searches.
+    """
+    def __init__(self, table: str, columns: Tuple[str, ...], reason: str, trigram: bool = False):
+        self.table = table
+        self.columns = columns
+        self.reasons = [reason]
+        self.trigram = trigram
+
+    @property
+    def key(self) -> tuple:
+        return (self.table, self.columns, self.trigram)
+
+    @property
+    def name(self) -> str:
+        name = f"{self.table}_{'_'.join(self.columns)}_{'trgm' if self.trigram else 'idx'}"
+        if len(name) <= 63:  return name
+        #Postgres truncates identifiers to 63 bytes; keep truncated names distinct so IF NOT EXISTS can't skip a different index
+        return f"{name[:54]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+
+    @property
+    def columns_sql(self) -> str:
+        opclass = " gin_trgm_ops" if self.trigram else ""
+        return ", ".join(f'"{column}"{opclass}' for column in self.columns)
+
+    @property
+    def create_sql(self) -> str:
+        method = "gin" if self.trigram else "btree"
+        return f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{self.name}" ON "{self.table}" USING {method} ({self.columns_sql})'
+
+    @property
+    def drop_sql(self) -> str:
+        return f'DROP INDEX CONCURRENTLY IF EXISTS "{self.name}"'
+
+    def is_satisfied_by(self, method: str, columns: List[Tuple[str, Optional[str]]], predicate: Optional[str] = None) -> bool:
+        #A partial index only covers the rows matching its WHERE clause
+        if predicate is not None:  return False
+        if self.trigram:
+            return method in ("gin", "gist") and all(any(name == column and opclass in TRIGRAM_OPCLASSES for name, opclass in columns) for column in self.columns)
+        #Non-default opclasses (e.g. varchar_pattern_ops) can't serve a general ORDER BY or equality lookup
+        return method == "btree" and columns[:len(self.columns)] == [(column, None) for column in self.columns]
+
+
+def _column_name(table: Table, field: str) -> Optional[str]:
+    field = field.lstrip("-").split("__")[0]
+    return field if field in table.columns else None
+
+
+def get_index_requirements(views: list) -> List[IndexRequirement]:
+    """
+    Collect the indexes behind every registered ViewSet and the authentication queries.
+    """
+    requirements: Dict[tuple, IndexRequirement] = {}
+
+    def require(table: Table, columns: Tuple[Optional[str], ...], reason: str, trigram: bool = False):
+        if None in columns:  return
+        requirement = IndexRequirement(table.name, columns, reason, trigram)
+        if requirement.key in requirements:
+            requirements[requirement.key].reasons.append(reason)
+        else:
+            requirements[requirement.key] = requirement
+
+    for view in views:
+        table = view.target_model.__table__
+        label = view.__class__.__name__
+        require(table, ("id",), f"{label} item lookup")
+        for field in view.ordering_fields:
+            require(table, (_column_name(table, field),), f"{label}.ordering_fields")
+        if view.default_ordering:
+            require(table, (_column_name(table, view.default_ordering),), f"{label}.default_ordering")
+        for field in view.search_fields:
+            require(table, (_column_name(table, field),), f"{label}.search_fields", trigram=True)
+        if view.change_feed:
+            require(ChangeEvent.__table__, ("table_name", "id"), f"{label} change feed resume")
+
+    require(User.__table__, ("id",), "get_current_user")
+    require(User.__table__, ("username",), "login")
+    require(user_group_table, ("user_id",), "user groups")
+    require(OutstandingToken.__table__, ("jti",), "refresh/logout")
+    require(OutstandingToken.__table__, ("expires_at",), "expired token purge")
+    require(BlacklistedToken.__table__, ("token_id",), "refresh/logout blacklist check")
+    require(ChangeEvent.__table__, ("created_at",), "change event purge")
+    return list(requirements.values())
+
+
+def parse_indexdef(indexdef: str) -> Tuple[Optional[str], List[Tuple[str, Optional[str]]], Optional[str]]:
+    """
+    Extract the access method, `(column, opclass)` pairs and the partial index predicate from a `pg_indexes.indexdef`.
+    The opclass is None for the default one. Expression columns can't be matched and come back with their whole expression as the name.
+    """
+    match = re.search(r"USING (\w+) \((.*?)\)(?: INCLUDE| WHERE| WITH|$)", indexdef)
+    if match is None:  return None, [], None
+    columns = []
+    for part in match.group(2).split(","):
+        tokens = part.strip().split()
+        if not tokens:  continue
+        #`column [COLLATE collation] [opclass] [ASC | DESC] [NULLS ...]`
+        rest = tokens[3:] if len(tokens) > 2 and tokens[1].upper() == "COLLATE" else tokens[1:]
+        opclass = rest[0] if rest and rest[0].upper() not in ("ASC", "DESC", "NULLS") else None
+        columns.append((tokens[0].strip('"'), opclass))
+    _, where, predicate = indexdef[match.end(2) + 1:].partition(" WHERE ")
+    return match.group(1), columns, predicate if where else None
+
+
+async def get_missing_indexes(conn: AsyncConnection, requirements: List[IndexRequirement]) -> Tuple[List[IndexRequirement], bool]:
+    """
+    Compare the requirements with the live catalog.
+    Returns the missing indexes and whether the `pg_trgm` extension has to be created.
+    """
+    tables = sorted({requirement.table for requirement in requirements})
+    stmt = text("SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename IN :tables").bindparams(bindparam("tables", expanding=True))
+    existing: Dict[str, list] = {}
+    for table, indexdef in (await conn.execute(stmt, {"tables": tables})).all():
+        existing.setdefault(table, []).append(parse_indexdef(indexdef))
+
+    missing = [
+        requirement for requirement in requirements
+        if not any(requirement.is_satisfied_by(*index) for index in existing.get(requirement.table, []))
+    ]
+    has_trigram = (await conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"))).scalar_one_or_none() is not None
+    return missing, any(requirement.trigram for requirement in missing) and not has_trigram
+
+
+async def advise_indexes(views: list) -> Tuple[List[IndexRequirement], bool]:
+    async with engine.connect() as conn:
+        return await get_missing_indexes(conn, get_index_requirements(views))
+
+
+def format_report(missing: List[IndexRequirement], needs_trigram: bool) -> str:
+    if not missing:  return "All indexes used by the registered ViewSets and authentication queries exist."
+    lines = [f"{len(missing)} missing index(es):"]
+    if needs_trigram:  lines.append("  CREATE EXTENSION IF NOT EXISTS pg_trgm  -- required by the trigram indexes below")
+    for requirement in missing:
+        lines.append(f"  {requirement.create_sql}  -- {', '.join(requirement.reasons)}")
+    return "\n".join(lines)
+
+
+def write_migration(missing: List[IndexRequirement], needs_trigram: bool, message: str = "add advised indexes") -> str:
+    """
+    Generate an Alembic revision in `alembic/versions` that creates the missing indexes concurrently.
+    Returns the path of the new revision.
+    """
+    from alembic.script import ScriptDirectory
+
+    script_directory = ScriptDirectory(ALEMBIC_DIR)
+    os.makedirs(script_directory.versions, exist_ok=True)
+    #CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction
+    upgrades = ["with op.get_context().autocommit_block():"]
+    if needs_trigram:  upgrades.append('    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")')
+    upgrades += [f"    op.execute({requirement.create_sql!r})" for requirement in missing]
+    downgrades = ["with op.get_context().autocommit_block():"]
+    downgrades += [f"    op.execute({requirement.drop_sql!r})" for requirement in reversed(missing)]
+    script = script_directory.generate_revision(uuid.uuid4().hex[:12], message, head="head", upgrades="\n    ".join(upgrades), downgrades="\n    ".join(downgrades))
+    return script.path
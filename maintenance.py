@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from sqlalchemy import delete, select, text
+from config import setting
+from database import SessionLocal, engine
+from models.change import ChangeEvent
+from models.token import BlacklistedToken, OutstandingToken
+
+logger = logging.getLogger(__name__)
+
+
+async def purge_expired_tokens(batch_size: int = None) -> int:
+    """
+    Delete expired outstanding tokens and their blacklist entries.
+
+    Rows are removed in chunks of `batch_size`, each in its own short transaction.
+    Rows locked by a concurrent refresh/logout are skipped and picked up by the next run.
+    Returns the number of deleted outstanding tokens.
+    """
+    batch_size = batch_size or setting.TOKEN_PURGE_BATCH_SIZE
+    now = datetime.now()
+    deleted = 0
+    while True:
+        async with SessionLocal() as db:
+            stmt = (
+                select(OutstandingToken.id)
+                .where(OutstandingToken.expires_at < now)
+                .order_by(OutstandingToken.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            ids = (await db.execute(stmt)).scalars().all()
+            if not ids:  break
+            await db.execute(delete(BlacklistedToken).where(BlacklistedToken.token_id.in_(ids)))
+            await db.execute(delete(OutstandingToken).where(OutstandingToken.id.in_(ids)))
+            await db.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:  break
+        #Give other tasks (and other sessions waiting on the table) a chance between chunks
+        await asyncio.sleep(0)
+    return deleted
+
+
+async def purge_change_events(batch_size: int = None) -> int:
+    """
+    Delete change feed events older than `CHANGE_FEED_RETENTION_HOURS`, in chunks like `purge_expired_tokens`.
+    """
+    batch_size = batch_size or setting.TOKEN_PURGE_BATCH_SIZE
+    threshold = datetime.now() - timedelta(hours=setting.CHANGE_FEED_RETENTION_HOURS)
+    deleted = 0
+    while True:
+        async with SessionLocal() as db:
+            ids = select(ChangeEvent.id).where(ChangeEvent.created_at < threshold).order_by(ChangeEvent.id).limit(batch_size).scalar_subquery()
+            count = (await db.execute(delete(ChangeEvent).where(ChangeEvent.id.in_(ids)))).rowcount
+            await db.commit()
+        deleted += count
+        if count < batch_size:  break
+        await asyncio.sleep(0)
+    return deleted
+
+
+async def purge_periodically(purge: Callable[[], Awaitable[int]], interval: float, what: str):
+    while True:
+        try:
+            deleted = await purge()
+            if deleted:  logger.info("Purged %s %s", deleted, what)
+        except Exception:
+            logger.exception("Periodic purge of %s failed", what)
+        await asyncio.sleep(interval)
+
+
+async def install_change_triggers() -> list[str]:
+    from config import views
+    from views.changes import get_trigger_sql
+    tables = sorted({view.target_model.__tablename__ for view in views if view.change_feed})
+    async with engine.begin() as conn:
+        for table in tables:
+            for statement in get_trigger_sql(table):
+                await conn.execute(text(statement))
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastDRF maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    purge = commands.add_parser("purge-tokens", help="Delete expired outstanding and blacklisted refresh tokens")
+    purge.add_argument("--batch-size", type=int, default=setting.TOKEN_PURGE_BATCH_SIZE)
+    commands.add_parser("purge-changes", help="Delete change feed events older than CHANGE_FEED_RETENTION_HOURS")
+    commands.add_parser("install-change-triggers", help="Install change feed triggers on the tables of ViewSets with change_feed enabled")
+    advise = commands.add_parser("advise-indexes", help="Report indexes missing for the registered ViewSets and authentication queries")
+    advise.add_argument("--write-migration", action="store_true", help="Generate an Alembic revision creating the missing indexes concurrently")
+
+    args = parser.parse_args()
+    if args.command == "purge-tokens":
+        deleted = asyncio.run(purge_expired_tokens(args.batch_size))
+        print(f"Purged {deleted} expired refresh tokens.")
+    elif args.command == "purge-changes":
+        deleted = asyncio.run(purge_change_events())
+        print(f"Purged {deleted} change feed events.")
+    elif args.command == "install-change-triggers":
+        tables = asyncio.run(install_change_triggers())
+        print(f"Installed change feed triggers on: {', '.join(tables) or 'no tables'}.")
+    elif args.command == "advise-indexes":
+        from config import views
+        from index_advisor import advise_indexes, format_report, write_migration
+        missing, needs_trigram = asyncio.run(advise_indexes(views))
+        print(format_report(missing, needs_trigram))
+        if args.write_migration and missing:
+            print(f"Wrote {write_migration(missing, needs_trigram)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+from sqlalchemy import BigInteger, Index, Integer, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from database import Base
+
+class ChangeEvent(Base):
+    __tablename__ = 'fastdrf_changeevent'
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    table_name: Mapped[str] = mapped_column(String(63), nullable=False)
+    op: Mapped[str] = mapped_column(String(10), nullable=False)
+    item_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False, index=True)
+
+    #Resuming a feed reads the events of one table after a given id
+    __table_args__ = (Index("fastdrf_changeevent_table_name_id", "table_name", "id"),)
@@ -10,7 +10,7 @@ class OutstandingToken(Base):
     token: Mapped[str] = mapped_column(String, nullable=False)
     jti: Mapped[str] = mapped_column(String, unique=True, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
-    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('auth_user.id'), nullable=False)
 
     user: Mapped["User"] = relationship("User", back_populates="tokens")
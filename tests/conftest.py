@@ -0,0 +1,11 @@
+import os
+import sys
+
+#`config` reads these when imported; the tests below never connect to the database
+os.environ.setdefault("DB_PASS", "test")
+os.environ.setdefault("DB_NAME", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#Load the app the way `main.py` does, so modules that import `config` aren't imported half-initialized
+import config  # noqa: E402,F401
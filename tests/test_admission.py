@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import admission
+from admission import AdmissionController
+
+
+def test_slot_handed_over_as_timeout_fires_is_released(monkeypatch):
+    async def scenario():
+        controller = AdmissionController("test-handoff", 1, queue_size=10, max_wait=1)
+        await controller.acquire()
+
+        async def wait_for(future, timeout):
+            #`release()` hands the slot over in the same loop iteration the timeout fires
+            controller.release()
+            assert future.done()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", wait_for)
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 503
+        assert controller.in_flight == 0
+        assert controller.waiters == []
+
+        monkeypatch.undo()
+        await controller.acquire()
+        assert controller.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiter_timing_out_in_queue_is_rejected():
+    async def scenario():
+        controller = AdmissionController("test-timeout", 1, queue_size=10, max_wait=0.05)
+        controller.service_time = 0
+        await controller.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 503
+        assert controller.timed_out == 1
+        assert controller.waiters == []
+        controller.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_hands_slot_to_highest_priority_waiter():
+    async def scenario():
+        controller = AdmissionController("test-priority", 1, queue_size=10, max_wait=1)
+        await controller.acquire()
+        order = []
+
+        async def request(priority):
+            await controller.acquire(priority)
+            order.append(priority)
+
+        tasks = [asyncio.create_task(request(priority)) for priority in (2, 1)]
+        await asyncio.sleep(0)
+        controller.release()
+        await asyncio.sleep(0)
+        controller.release()
+        await asyncio.gather(*tasks)
+        assert order == [1, 2]
+        assert controller.in_flight == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,20 @@
+import pytest
+
+from index_advisor import IndexRequirement, parse_indexdef
+
+FIRST_NAME = IndexRequirement("auth_user", ("first_name",), "ordering")
+USERNAME_TRGM = IndexRequirement("auth_user", ("username",), "search", trigram=True)
+
+
+@pytest.mark.parametrize("indexdef, requirement, satisfied", [
+    ("CREATE INDEX i ON public.auth_user USING btree (first_name)", FIRST_NAME, True),
+    ("CREATE INDEX i ON public.auth_user USING btree (first_name DESC NULLS LAST, id)", FIRST_NAME, True),
+    ("CREATE INDEX i ON public.auth_user USING btree (first_name) WHERE is_active", FIRST_NAME, False),
+    ("CREATE INDEX i ON public.auth_user USING btree (first_name varchar_pattern_ops)", FIRST_NAME, False),
+    ('CREATE INDEX i ON public.auth_user USING btree (first_name COLLATE "C" text_pattern_ops)', FIRST_NAME, False),
+    ("CREATE INDEX i ON public.auth_user USING btree (id, first_name)", FIRST_NAME, False),
+    ("CREATE INDEX i ON public.auth_user USING gin (username gin_trgm_ops)", USERNAME_TRGM, True),
+    ("CREATE INDEX i ON public.auth_user USING gin (username gin_trgm_ops) WHERE (is_active)", USERNAME_TRGM, False),
+])
+def test_is_satisfied_by(indexdef, requirement, satisfied):
+    assert requirement.is_satisfied_by(*parse_indexdef(indexdef)) is satisfied
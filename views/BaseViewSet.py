@@ -1,7 +1,11 @@
+import copy
+import inspect
 from functools import wraps
-from fastapi import APIRouter, Depends, HTTPException,Query as Q,status
+from fastapi import APIRouter, Depends, HTTPException,Query as Q,Request,Response,status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, create_model
 from sqlalchemy import func as f, or_, select
+from sqlalchemy.exc import DBAPIError, TimeoutError as SQLAlchemyTimeoutError
 from sqlalchemy.orm import Session,DeclarativeMeta
 from sqlalchemy.sql import Select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -16,11 +20,19 @@ class Method(str,Enum):
     delete = "delete"
     update = "update"
     post = "post"
+    changes = "changes"
+    aggregate = "aggregate"
 
 from authentication import get_current_user
 from models.user import User
-from database import get_db
+from admission import AdmissionController, get_admission_dependency
+from config import setting
+from database import get_db, set_statement_timeout
 from permissions.BasePermission import AllowAll, BasePermission
+from views.changes import notify_change, stream_changes
+from views.aggregate import TTLCache, generate_aggregate_schema, get_aggregate_desc, get_dimension, get_metric
+from views.timeouts import ClientDisconnected, is_statement_timeout, run_until_disconnected
+from views.negotiation import BaseParser, BaseRenderer, JSONParser, JSONRenderer, MessagePackParser, MessagePackRenderer, get_body_parser, get_openapi_request_body, get_openapi_responses, select_renderer
 
 
 
@@ -43,6 +55,15 @@ def get_read_desc(search_fields: List[str],ordering_fields: List[str],default_or
     description+=f"\nDefault ordering field is: `{default_ordering}`"
     return description
 
+CHANGES_DESC = """
+Server-sent events for every item created, updated or deleted.
+
+Each event carries the event `id`, the operation as event type and `{"id", "op", "item_id"}` as data.
+Create and update events are filtered with the `get` permission of the item, delete events with the `read` permission.
+Reconnect with `Last-Event-ID` (or `last_event_id`) to receive the events missed in between;
+a `reset` event means they are no longer available and the list should be refetched.
+"""
+
 def generate_pydantic_schema(
     model: Type[DeclarativeMeta],
     schema_name: str,
@@ -134,6 +155,33 @@ class BaseViewSet:
 
     exclude_methods: List[Method] = []
 
+    #Statement timeout in milliseconds for the generated routes, overridable per method.
+    #Falls back to `DB_STATEMENT_TIMEOUT_MS`; 0 disables it.
+    statement_timeout: Optional[int] = None
+    statement_timeouts: Dict[Method, int] = {}
+
+    #Opt-in `GET /changes` server-sent events stream of create/update/delete events
+    change_feed: bool = False
+    #Set once the database triggers are installed (`python maintenance.py install-change-triggers`)
+    change_feed_triggers: bool = False
+
+    #Opt-in `GET /aggregate`: allowed group-by dimensions (`column` or `column__day`, `__month`, ...)
+    #and metrics (`count` or `sum__column`, `avg__column`, `min__column`, `max__column`, `count__column`)
+    aggregate_dimensions: list[str] = []
+    aggregate_metrics: list[str] = ["count"]
+    #Seconds to cache aggregate results for (0 disables caching)
+    aggregate_cache_ttl: int = 0
+
+    #Lower priorities are admitted first when requests queue for a database connection.
+    #Methods missing here skip admission control (e.g. the long-lived change feed).
+    method_priorities: Dict[Method, int] = {Method.get: 1, Method.create: 1, Method.update: 1, Method.delete: 1, Method.post: 1, Method.read: 2, Method.aggregate: 2}
+    #Maximum number of concurrent requests for this ViewSet (None means only the database limit applies)
+    concurrency_limit: Optional[int] = None
+
+    #The first renderer/parser is used when the client doesn't send Accept/Content-Type
+    renderer_classes: List[Type[BaseRenderer]] = [JSONRenderer, MessagePackRenderer]
+    parser_classes: List[Type[BaseParser]] = [JSONParser, MessagePackParser]
+
     perotect_by: BasePermission =   AllowAll
     description:   str =   ""
     def __init__(self, prefix: str, tags: list[str] = None):
@@ -144,6 +192,12 @@ class BaseViewSet:
             inst = self.perotect_by()
             self.perotect_by = inst
         self.openapi_tag_metadata = [{"name":tag,"description":self.description or f"*`{self.perotect_by.expression}`*"} for tag in tags]
+        self.renderers = [renderer() for renderer in self.renderer_classes]
+        self.parsers = [parser() for parser in self.parser_classes]
+        #Nested models of negotiated bodies, added to the OpenAPI components by `install_openapi_components`
+        self.openapi_components: Dict[str, dict] = {}
+        self.admission_controller = AdmissionController(prefix, self.concurrency_limit) if self.concurrency_limit else None
+        self.aggregate_cache = TTLCache(self.aggregate_cache_ttl) if self.aggregate_cache_ttl else None
 
 
         self.read_response_schema = self.read_response_schema or generate_pydantic_schema(self.target_model, f"{self.target_model.__name__}Read")
@@ -155,35 +209,92 @@ class BaseViewSet:
         self.post_response_schema = self.post_response_schema or EmptySchema
         self.delete_response_schema = self.delete_response_schema or EmptySchema
 
-        if Method.read not in self.exclude_methods: self.router.get("",response_model=ListResponse[self.read_response_schema],description=get_read_desc(self.search_fields,self.ordering_fields,self.default_ordering))(self._build_method(self._read()))
-        if Method.get not in self.exclude_methods:  self.router.get("/{item_id}",response_model=self.get_response_schema)(self._build_method(self._get()))
-        if Method.create not in self.exclude_methods:   self.router.put("",response_model=self.create_response_schema)(self._build_method(self._create()))
-        if Method.update not in self.exclude_methods:   self.router.patch("/{item_id}",response_model=self.update_response_schema)(self._build_method(self._update()))
-        if Method.delete not in self.exclude_methods:   self.router.delete("/{item_id}",response_model=self.delete_response_schema)(self._build_method(self._delete()))
-        if hasattr(self,"_post"):   self.router.post("",response_model=self.post_response_schema)(self._build_method(self._post()))
+        read_response_model = ListResponse[self.read_response_schema]
+        if Method.read not in self.exclude_methods: self.router.get("",dependencies=self._get_admission_dependencies(Method.read),response_model=read_response_model,responses=get_openapi_responses(read_response_model,self.renderers,self.openapi_components),description=get_read_desc(self.search_fields,self.ordering_fields,self.default_ordering))(self._build_method(self._read(),read_response_model))
+        if self.change_feed and Method.changes not in self.exclude_methods: self.router.get("/changes",dependencies=self._get_admission_dependencies(Method.changes),responses={200: {"description": "Server-sent events stream", "content": {"text/event-stream": {}}}},description=CHANGES_DESC)(self._build_method(self._changes()))
+        if self.aggregate_dimensions and Method.aggregate not in self.exclude_methods:
+            aggregate_schema = generate_aggregate_schema(f"{self.target_model.__name__}Aggregate", self.target_query.subquery().c, self.aggregate_dimensions, self.aggregate_metrics)
+            aggregate_response_model = ListResponse[aggregate_schema]
+            self.router.get("/aggregate",dependencies=self._get_admission_dependencies(Method.aggregate),response_model=aggregate_response_model,responses=get_openapi_responses(aggregate_response_model,self.renderers,self.openapi_components),description=get_aggregate_desc(self.aggregate_dimensions,self.aggregate_metrics))(self._build_method(self._aggregate(),aggregate_response_model,permission_method=Method.read))
+        if Method.get not in self.exclude_methods:  self.router.get("/{item_id}",dependencies=self._get_admission_dependencies(Method.get),response_model=self.get_response_schema,responses=get_openapi_responses(self.get_response_schema,self.renderers,self.openapi_components))(self._build_method(self._get(),self.get_response_schema))
+        if Method.create not in self.exclude_methods:   self.router.put("",dependencies=self._get_admission_dependencies(Method.create),response_model=self.create_response_schema,responses=get_openapi_responses(self.create_response_schema,self.renderers,self.openapi_components),openapi_extra=get_openapi_request_body(self.create_request_schema,self.parsers,self.openapi_components))(self._build_method(self._create(),self.create_response_schema))
+        if Method.update not in self.exclude_methods:   self.router.patch("/{item_id}",dependencies=self._get_admission_dependencies(Method.update),response_model=self.update_response_schema,responses=get_openapi_responses(self.update_response_schema,self.renderers,self.openapi_components),openapi_extra=get_openapi_request_body(self.update_request_schema,self.parsers,self.openapi_components))(self._build_method(self._update(),self.update_response_schema))
+        if Method.delete not in self.exclude_methods:   self.router.delete("/{item_id}",dependencies=self._get_admission_dependencies(Method.delete),response_model=self.delete_response_schema,responses=get_openapi_responses(self.delete_response_schema,self.renderers,self.openapi_components))(self._build_method(self._delete(),self.delete_response_schema))
+        if hasattr(self,"_post"):   self.router.post("",dependencies=self._get_admission_dependencies(Method.post),response_model=self.post_response_schema,responses=get_openapi_responses(self.post_response_schema,self.renderers,self.openapi_components))(self._build_method(self._post(),self.post_response_schema))
+
+    def _get_admission_dependencies(self, method: Method) -> list:
+        priority = self.method_priorities.get(method)
+        if priority is None:    return []
+        controllers = [self.admission_controller] if self.admission_controller else []
+        return [Depends(get_admission_dependency(priority, *controllers))]
+
+    async def _notify_change(self, db: AsyncSession, op: Method, item_id: int):
+        if self.change_feed and not self.change_feed_triggers:
+            await notify_change(db, self.target_model.__tablename__, op.value, item_id)
 
     async def _check_permissions(self, user: User, method: Method,db: AsyncSession,other_kwargs: dict):
         if not self.perotect_by==None and not await self.perotect_by.has_permission(user,method,self.target_query,db,other_kwargs):
             raise   HTTPException(403,{"status":"Access denied.","messages":list(set(self.perotect_by.messages))})
 
-    def _build_method(self,func:Callable):
+    def _render(self, result, response_model: Type[BaseModel], renderer: BaseRenderer) -> Response:
+        if not isinstance(result, response_model):
+            #e.g. an unparametrized ListResponse holding ORM objects
+            if isinstance(result, BaseModel):   result = dict(result)
+            result = response_model.model_validate(result, from_attributes=True)
+        return Response(content=renderer.render(result.model_dump(by_alias=True)), media_type=renderer.media_type, headers={"Vary": "Accept"})
+
+    def _build_method(self,func:Callable,response_model:Optional[Type[BaseModel]]=None,permission_method:Optional[Method]=None):
+        #`permission_method` lets a route reuse another method's permission, e.g. aggregates follow `read`
+        signature = inspect.signature(func)
+        takes_request = "request" in signature.parameters
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
             method_name = func.__name__
-            await self._check_permissions(user=kwargs['user'],method=method_name,db=kwargs['db'],other_kwargs=kwargs)
-            return await func(*args, **kwargs)
+            request: Request = kwargs["request"] if takes_request else kwargs.pop("request")
+            renderer = select_renderer(self.renderers, request.headers.get("accept")) if response_model else None
+            db: AsyncSession = kwargs['db']
+            timeout = self.statement_timeouts.get(method_name, self.statement_timeout if self.statement_timeout is not None else setting.DB_STATEMENT_TIMEOUT_MS)
+            if timeout: await set_statement_timeout(db, timeout)
+
+            async def handle():
+                await self._check_permissions(user=kwargs['user'],method=permission_method or method_name,db=db,other_kwargs=kwargs)
+                return await func(*args, **kwargs)
+            try:
+                result = await run_until_disconnected(request, handle())
+            except ClientDisconnected:
+                #Nobody is waiting for the answer; drop the connection the cancelled query ran on
+                await db.invalidate()
+                return Response(status_code=499)
+            except DBAPIError as e:
+                if is_statement_timeout(e):
+                    raise HTTPException(status.HTTP_504_GATEWAY_TIMEOUT, "The request took too long to process.")
+                raise
+            except SQLAlchemyTimeoutError:
+                raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "The database is busy, please try again later.", headers={"Retry-After": "1"})
+            if renderer is None or result is None or isinstance(result, Response):  return result
+            return self._render(result, response_model, renderer)
+
+        #Expose the request to FastAPI so the response can be negotiated from the Accept header
+        if not takes_request:
+            parameters = [*signature.parameters.values(), inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)]
+            wrapper.__signature__ = signature.replace(parameters=parameters)
         return wrapper   
 
+    def _apply_search(self, stmt: Select, search: Optional[str]) -> Select:
+        if search and self.search_fields:
+            filters = []
+            for field in self.search_fields:
+                filters.append(getattr(self.target_model, field).ilike(f"%{search}%"))
+            stmt = stmt.where(or_(*filters))
+        return stmt
+
     def _read(self)->Callable:        
         async def read(offset: int = Q(0, ge=0),limit: int = Q(10, le=100),ordering: Optional[str] = Q(None),search: Optional[str] = Q(None),db: Session = Depends(get_db),user: User = Depends(get_current_user)):          
             stmt = self.target_query
             if ordering and ordering.lstrip("-") not in self.ordering_fields:
                 raise HTTPException(status.HTTP_400_BAD_REQUEST,"The ordering field is not supported.")
-            if search and self.search_fields:
-                filters = []
-                for field in self.search_fields:
-                    filters.append(getattr(self.target_model, field).ilike(f"%{search}%"))
-                stmt = stmt.where(or_(*filters))
+            stmt = self._apply_search(stmt, search)
 
             if ordering:
                 col = getattr(self.target_model, ordering.lstrip("-"))
@@ -212,9 +323,11 @@ class BaseViewSet:
     
     def _create(self)->Callable:
         schema = self.create_request_schema
-        async def create(data: schema, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+        async def create(data: schema = Depends(get_body_parser(schema,self.parsers)), db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
             item = self.target_model(**data.model_dump())
             db.add(item)
+            await   db.flush()
+            await   self._notify_change(db, Method.create, item.id)
             await   db.commit()
             await   db.refresh(item)
             return self.create_response_schema.model_validate(item, from_attributes=True)
@@ -222,7 +335,7 @@ class BaseViewSet:
     
     def _update(self)->Callable:
         schema = self.update_request_schema
-        async def update(item_id: int, data: schema, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+        async def update(item_id: int, data: schema = Depends(get_body_parser(schema,self.parsers)), db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
             stmt = self.target_query
             stmt = stmt.where(self.target_model.id == item_id)
             result = await db.execute(stmt)
@@ -230,6 +343,7 @@ class BaseViewSet:
             if item==None:  raise   HTTPException(404,"Item not found.")
             for k, v in data.model_dump(exclude_unset=True).items():
                 setattr(item, k, v)
+            await   self._notify_change(db, Method.update, item.id)
             await   db.commit()
             await   db.refresh(item)
             return self.update_response_schema.model_validate(item, from_attributes=True)
@@ -243,6 +357,50 @@ class BaseViewSet:
             item = result.unique().scalar_one_or_none()
             if item==None:  raise   HTTPException(404,"Item not found.")
             await   db.delete(item)
+            await   self._notify_change(db, Method.delete, item.id)
             await   db.commit()
             return self.delete_response_schema()
-        return delete
\ No newline at end of file
+        return delete
+
+    def _changes(self)->Callable:
+        async def is_allowed(user: User, event: dict, db: AsyncSession) -> bool:
+            if self.perotect_by==None:  return True
+            #A copy per check, so failure messages don't pile up on the shared instance for the life of the stream
+            permission = copy.deepcopy(self.perotect_by)
+            if event["op"] == Method.delete.value:
+                #The row is gone, so object-level checks can't pass; deletes follow the list permission
+                return await permission.has_permission(user,Method.read,self.target_query,db,{"event": event})
+            return await permission.has_permission(user,Method.get,self.target_query,db,{"item_id": event["item_id"], "event": event})
+
+        async def changes(request: Request, last_event_id: Optional[int] = Q(None, description="Resume after this event id (the `Last-Event-ID` header is used as well)"), db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+            if last_event_id is None and request.headers.get("last-event-id", "").isdigit():
+                last_event_id = int(request.headers["last-event-id"])
+            events = stream_changes(self.target_model.__tablename__, request, last_event_id, lambda event, db: is_allowed(user, event, db))
+            return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        return changes
+
+    def _aggregate(self)->Callable:
+        async def aggregate(group_by: List[str] = Q([]),metrics: Optional[List[str]] = Q(None, description="Defaults to the first declared metric"),search: Optional[str] = Q(None),limit: int = Q(100, ge=1, le=1000),db: AsyncSession = Depends(get_db),user: User = Depends(get_current_user)):
+            metrics = metrics or self.aggregate_metrics[:1]
+            if not set(group_by) <= set(self.aggregate_dimensions):
+                raise HTTPException(status.HTTP_400_BAD_REQUEST,"The group_by dimension is not supported.")
+            if not metrics or not set(metrics) <= set(self.aggregate_metrics):
+                raise HTTPException(status.HTTP_400_BAD_REQUEST,"The metric is not supported.")
+            group_by, metrics = list(dict.fromkeys(group_by)), list(dict.fromkeys(metrics))
+            cache_key = (tuple(group_by), tuple(metrics), search, limit)
+            cached = self.aggregate_cache.get(cache_key) if self.aggregate_cache else None
+
+            if cached is None:
+                subq = self._apply_search(self.target_query, search).order_by(None).subquery()
+                dimensions = [get_dimension(subq.c, name)[0] for name in group_by]
+                columns = [expr.label(name) for name, expr in zip(group_by, dimensions)]
+                columns += [get_metric(subq.c, name)[0].label(name) for name in metrics]
+                stmt = select(*columns).select_from(subq).group_by(*dimensions)
+                #`count` is the number of groups, so clients can tell when `limit` cut the result short
+                count = (await db.execute(select(f.count()).select_from(stmt.subquery()))).scalar_one()
+                rows = [dict(row) for row in (await db.execute(stmt.order_by(*dimensions).limit(limit))).mappings()]
+                cached = (count, rows)
+                if self.aggregate_cache:    self.aggregate_cache.set(cache_key, cached)
+            count, rows = cached
+            return ListResponse(count=count,result=rows)
+        return aggregate
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, create_model
+from sqlalchemy import ColumnElement, func as f
+
+#`<column>__<unit>` groups a date/time column by `date_trunc(unit, column)`
+TRUNCATIONS = {"year", "quarter", "month", "week", "day", "hour", "minute"}
+FUNCTIONS: Dict[str, Callable] = {"sum": f.sum, "avg": f.avg, "min": f.min, "max": f.max, "count": f.count}
+
+
+def _split(name: str) -> Tuple[str, Optional[str]]:
+    column, _, suffix = name.partition("__")
+    return column, suffix or None
+
+
+def get_dimension(columns, name: str) -> Tuple[ColumnElement, type]:
+    """
+    Resolve a group-by dimension (`column` or `column__<unit>`) against the columns of a subquery.
+    """
+    column_name, unit = _split(name)
+    column = columns[column_name]
+    if unit is None:  return column, column.type.python_type
+    if unit not in TRUNCATIONS:  raise ValueError(f"Unknown truncation '{unit}' in dimension '{name}'.")
+    return f.date_trunc(unit, column), datetime
+
+
+def get_metric(columns, name: str) -> Tuple[ColumnElement, type]:
+    """
+    Resolve a metric: `count` counts rows, `<function>__<column>` aggregates a column.
+    """
+    if name == "count":  return f.count(), int
+    function_name, column_name = _split(name)
+    if function_name not in FUNCTIONS or column_name is None:  raise ValueError(f"Unknown metric '{name}'.")
+    column = columns[column_name]
+    if function_name == "count":  return f.count(column), int
+    if function_name == "avg":  return f.avg(column), float
+    python_type = column.type.python_type
+    if function_name == "sum" and python_type is not int:  python_type = float
+    return FUNCTIONS[function_name](column), python_type
+
+
+def generate_aggregate_schema(schema_name: str, columns, dimensions: List[str], metrics: List[str]) -> Type[BaseModel]:
+    #Every field is optional since a request only returns the dimensions and metrics it asked for
+    fields = {}
+    for name in dimensions:  fields[name] = (Optional[get_dimension(columns, name)[1]], None)
+    for name in metrics:  fields[name] = (Optional[get_metric(columns, name)[1]], None)
+    return create_model(schema_name, **fields)
+
+
+def get_aggregate_desc(dimensions: List[str], metrics: List[str]) -> str:
+    description = "Valid `group_by` dimensions are:\n"
+    for name in dimensions:   description+=f"- `{name}`\n\n"
+    description+="\nValid `metrics` are:\n"
+    for name in metrics:   description+=f"- `{name}`\n\n"
+    description+="\nThe same `search` filter and `read` permission as the list endpoint are applied before grouping."
+    return description
+
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        entry = self.items.get(key)
+        if entry is None:  return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.items[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+import asyncpg
+from fastapi import Request
+from sqlalchemy import func as f, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import setting
+from database import SessionLocal
+from models.change import ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+
+def get_channel(table_name: str) -> str:
+    return f"{table_name}_changes"
+
+
+def get_trigger_sql(table_name: str) -> list[str]:
+    """
+    DDL that makes writes coming from outside FastAPI (e.g. Django) feed the same change log.
+    Enable `change_feed_triggers` on the ViewSet once it's installed so events aren't emitted twice.
+    """
+    return [
+        """
+        CREATE OR REPLACE FUNCTION fastdrf_notify_change() RETURNS trigger AS $$
+        DECLARE
+            event_id bigint;
+            row_id integer;
+            event_op varchar(10);
+        BEGIN
+            IF TG_OP = 'DELETE' THEN row_id := OLD.id; ELSE row_id := NEW.id; END IF;
+            event_op := CASE TG_OP WHEN 'INSERT' THEN 'create' WHEN 'UPDATE' THEN 'update' ELSE 'delete' END;
+            INSERT INTO fastdrf_changeevent (table_name, op, item_id, created_at)
+                VALUES (TG_TABLE_NAME, event_op, row_id, LOCALTIMESTAMP) RETURNING id INTO event_id;
+            PERFORM pg_notify(TG_TABLE_NAME || '_changes', json_build_object('id', event_id, 'op', event_op, 'item_id', row_id)::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        f'DROP TRIGGER IF EXISTS fastdrf_change_feed ON "{table_name}"',
+        f'CREATE TRIGGER fastdrf_change_feed AFTER INSERT OR UPDATE OR DELETE ON "{table_name}" FOR EACH ROW EXECUTE FUNCTION fastdrf_notify_change()',
+    ]
+
+
+async def notify_change(db: AsyncSession, table_name: str, op: str, item_id: int):
+    """
+    Record a change in the event log and notify listeners.
+    Both happen inside the session's transaction, so nothing is published unless it commits.
+    """
+    event_id = (await db.execute(insert(ChangeEvent).values(table_name=table_name, op=op, item_id=item_id).returning(ChangeEvent.id))).scalar_one()
+    payload = json.dumps({"id": event_id, "op": op, "item_id": item_id})
+    await db.execute(select(f.pg_notify(get_channel(table_name), payload)))
+
+
+class Subscription:
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(setting.CHANGE_FEED_QUEUE_SIZE)
+        #Set when events were dropped; the subscriber then replays them from the event log
+        self.overflowed = False
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class ChangeFeed:
+    """
+    Shares a single LISTEN connection per process between all change feed subscribers.
+    """
+    def __init__(self):
+        self.connection: Optional[asyncpg.Connection] = None
+        self.subscriptions: Dict[str, Set[Subscription]] = {}
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self.lock:
+            await self._connect()
+
+    async def _connect(self):
+        if self.connection is not None and not self.connection.is_closed():  return
+        self.connection = await asyncpg.connect(user=setting.DB_USER, password=setting.DB_PASS, host=setting.DB_HOST, port=setting.DB_PORT, database=setting.DB_NAME)
+        self.connection.add_termination_listener(self._on_termination)
+        for channel in self.subscriptions:
+            await self.connection.add_listener(channel, self._dispatch)
+
+    def _on_termination(self, connection: asyncpg.Connection):
+        #Notifications sent while disconnected are lost, so everyone replays from the log
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:  subscription.overflowed = True
+
+    def _dispatch(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed change notification on %s: %r", channel, payload)
+            return
+        for subscription in list(self.subscriptions.get(channel, ())):
+            subscription.push(event)
+
+    async def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel)
+        async with self.lock:
+            await self._connect()
+            if channel not in self.subscriptions:
+                self.subscriptions[channel] = set()
+                await self.connection.add_listener(channel, self._dispatch)
+            self.subscriptions[channel].add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        async with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel)
+            if subscriptions is None:  return
+            subscriptions.discard(subscription)
+            if subscriptions:  return
+            del self.subscriptions[subscription.channel]
+            if self.connection is not None and not self.connection.is_closed():
+                await self.connection.remove_listener(subscription.channel, self._dispatch)
+
+    async def close(self):
+        async with self.lock:
+            if self.connection is not None and not self.connection.is_closed():
+                await self.connection.close()
+            self.connection = None
+
+
+change_feed = ChangeFeed()
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
+
+
+class SeenEvents:
+    """
+    Ids a stream has already handled, kept for the replay window below the highest one.
+    """
+    def __init__(self):
+        self.ids: Set[int] = set()
+        self.cursor = 0
+
+    @property
+    def window_start(self) -> int:
+        return max(self.cursor - setting.CHANGE_FEED_REPLAY_WINDOW, 0)
+
+    def add(self, event_id: int):
+        self.ids.add(event_id)
+        self.cursor = max(self.cursor, event_id)
+        if len(self.ids) > 2 * setting.CHANGE_FEED_REPLAY_WINDOW:
+            self.ids = {i for i in self.ids if i > self.window_start}
+
+    def __contains__(self, event_id: int) -> bool:
+        return event_id in self.ids
+
+
+IsAllowed = Callable[[dict, AsyncSession], Awaitable[bool]]
+
+
+async def _start_from_latest(db: AsyncSession, table_name: str, seen: SeenEvents) -> int:
+    #Everything committed so far is already reflected in what the client fetches, including
+    #events queued since subscribing, so only the window below the latest id counts as handled
+    latest_id = (await db.execute(select(f.max(ChangeEvent.id)).where(ChangeEvent.table_name == table_name))).scalar_one() or 0
+    seen.ids, seen.cursor = set(), latest_id
+    stmt = select(ChangeEvent.id).where(ChangeEvent.table_name == table_name, ChangeEvent.id > seen.window_start)
+    for event_id in (await db.execute(stmt)).scalars():  seen.add(event_id)
+    return latest_id
+
+
+def _reset_event(latest_id: int) -> str:
+    return f"event: reset\ndata: {json.dumps({'id': latest_id})}\n\n"
+
+
+async def _replay(table_name: str, seen: SeenEvents, is_allowed: IsAllowed) -> AsyncIterator[str]:
+    """
+    Send the logged events this stream hasn't handled yet, a page at a time.
+    Each page is read and permission-checked with one session, which is closed before the page is sent.
+    """
+    after_id = seen.window_start
+    async with SessionLocal() as db:
+        backlog_stmt = select(ChangeEvent.id).where(ChangeEvent.table_name == table_name, ChangeEvent.id > after_id).limit(setting.CHANGE_FEED_MAX_REPLAY + 1)
+        backlog = (await db.execute(select(f.count()).select_from(backlog_stmt.subquery()))).scalar_one()
+        if backlog > setting.CHANGE_FEED_MAX_REPLAY:
+            #Too far behind to catch up event by event
+            latest_id = await _start_from_latest(db, table_name, seen)
+    if backlog > setting.CHANGE_FEED_MAX_REPLAY:
+        yield _reset_event(latest_id)
+        return
+    while True:
+        async with SessionLocal() as db:
+            stmt = select(ChangeEvent).where(ChangeEvent.table_name == table_name, ChangeEvent.id > after_id).order_by(ChangeEvent.id).limit(setting.CHANGE_FEED_REPLAY_BATCH_SIZE)
+            events = [{"id": e.id, "op": e.op, "item_id": e.item_id} for e in (await db.execute(stmt)).scalars()]
+            allowed = []
+            for event in events:
+                if event["id"] in seen:  continue
+                seen.add(event["id"])
+                if await is_allowed(event, db):  allowed.append(event)
+        for event in allowed:  yield format_event(event)
+        if len(events) < setting.CHANGE_FEED_REPLAY_BATCH_SIZE:  return
+        after_id = events[-1]["id"]
+
+
+async def stream_changes(table_name: str, request: Request, last_event_id: Optional[int], is_allowed: IsAllowed):
+    """
+    Server-sent events for one table.
+
+    Event ids are taken when a row is inserted, not when it commits, so a lower id can show up
+    after a higher one. Replays therefore re-read `CHANGE_FEED_REPLAY_WINDOW` ids below the
+    cursor and skip the ones this stream already handled. On resume the client may see a few
+    recent events again (delivery is at-least-once). If `last_event_id` has already been
+    pruned, or more than `CHANGE_FEED_MAX_REPLAY` events were missed, a `reset` event tells
+    the client to refetch instead.
+    """
+    subscription = await change_feed.subscribe(get_channel(table_name))
+    seen = SeenEvents()
+    try:
+        async with SessionLocal() as db:
+            if last_event_id is not None:
+                exists = (await db.execute(select(ChangeEvent.id).where(ChangeEvent.id == last_event_id, ChangeEvent.table_name == table_name))).scalar_one_or_none()
+                if exists is None:
+                    yield _reset_event(await _start_from_latest(db, table_name, seen))
+                    last_event_id = None
+                else:
+                    seen.add(last_event_id)
+            else:
+                await _start_from_latest(db, table_name, seen)
+        replay = last_event_id is not None
+
+        while True:
+            if replay or subscription.overflowed:
+                replay = subscription.overflowed = False
+                #Whatever is queued is re-read from the log below
+                while not subscription.queue.empty():  subscription.queue.get_nowait()
+                async for message in _replay(table_name, seen, is_allowed):  yield message
+
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), setting.CHANGE_FEED_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():  return
+                await change_feed.connect()
+                yield ": keepalive\n\n"
+                continue
+            if event["id"] in seen:  continue
+            seen.add(event["id"])
+            async with SessionLocal() as db:
+                allowed = await is_allowed(event, db)
+            if allowed:  yield format_event(event)
+    finally:
+        await change_feed.unsubscribe(subscription)
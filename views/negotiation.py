@@ -0,0 +1,169 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, List, Optional, Sequence, Type
+from uuid import UUID
+
+import msgpack
+import orjson
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+
+def _default(obj: Any):
+    #Fallback for types that orjson/msgpack can't encode natively
+    if isinstance(obj, (datetime, date, time)):  return obj.isoformat()
+    if isinstance(obj, (Decimal, UUID)):  return str(obj)
+    if isinstance(obj, Enum):  return obj.value
+    if isinstance(obj, BaseModel):  return obj.model_dump(by_alias=True)
+    if isinstance(obj, (set, frozenset)):  return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class BaseRenderer:
+    media_type: str
+    aliases: Sequence[str] = ()
+
+    def matches(self, media_range: str) -> bool:
+        if media_range in ("*/*", self.media_type) or media_range in self.aliases:
+            return True
+        main_type, _, sub_type = media_range.partition("/")
+        return sub_type == "*" and self.media_type.startswith(f"{main_type}/")
+
+    def render(self, data: Any) -> bytes:
+        raise NotImplementedError("You must implement render method")
+
+
+class JSONRenderer(BaseRenderer):
+    media_type = "application/json"
+
+    def render(self, data: Any) -> bytes:
+        return orjson.dumps(data, default=_default)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    aliases = ("application/x-msgpack", "application/vnd.msgpack")
+
+    def render(self, data: Any) -> bytes:
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class BaseParser:
+    media_type: str
+    aliases: Sequence[str] = ()
+
+    def matches(self, content_type: str) -> bool:
+        return content_type == self.media_type or content_type in self.aliases
+
+    def parse(self, body: bytes) -> Any:
+        raise NotImplementedError("You must implement parse method")
+
+
+class JSONParser(BaseParser):
+    media_type = "application/json"
+
+    def parse(self, body: bytes) -> Any:
+        return orjson.loads(body)
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+    aliases = ("application/x-msgpack", "application/vnd.msgpack")
+
+    def parse(self, body: bytes) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+def parse_accept(accept: str) -> List[str]:
+    """
+    Split an `Accept` header into media ranges ordered by their quality value.
+    Ranges with `q=0` are dropped.
+    """
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_range, *params = [p.strip() for p in part.split(";")]
+        if not media_range:  continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:  ranges.append((-quality, position, media_range.lower()))
+    return [media_range for *_, media_range in sorted(ranges)]
+
+
+def select_renderer(renderers: List[BaseRenderer], accept: Optional[str]) -> BaseRenderer:
+    if not accept:  return renderers[0]
+    for media_range in parse_accept(accept):
+        for renderer in renderers:
+            if renderer.matches(media_range):  return renderer
+    raise HTTPException(status.HTTP_406_NOT_ACCEPTABLE, "Could not satisfy the request Accept header.")
+
+
+def select_parser(parsers: List[BaseParser], content_type: Optional[str]) -> BaseParser:
+    if not content_type:  return parsers[0]
+    content_type = content_type.split(";")[0].strip().lower()
+    for parser in parsers:
+        if parser.matches(content_type):  return parser
+    raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Unsupported media type '{content_type}' in request.")
+
+
+def openapi_schema(schema: Type[BaseModel], components: dict, mode: str = "validation") -> dict:
+    #Nested models are referenced from the components section, see `install_openapi_components`
+    json_schema = schema.model_json_schema(ref_template="#/components/schemas/{model}", mode=mode)
+    components.update(json_schema.pop("$defs", {}))
+    return json_schema
+
+
+def get_openapi_responses(schema: Type[BaseModel], renderers: List[BaseRenderer], components: dict) -> dict:
+    """
+    Extra OpenAPI response content for every renderer besides the default JSON one.
+    """
+    content = {renderer.media_type: {"schema": openapi_schema(schema, components, "serialization")} for renderer in renderers if renderer.media_type != "application/json"}
+    return {200: {"content": content}} if content else {}
+
+
+def get_openapi_request_body(schema: Type[BaseModel], parsers: List[BaseParser], components: dict) -> dict:
+    return {"requestBody": {"required": True, "content": {parser.media_type: {"schema": openapi_schema(schema, components)} for parser in parsers}}}
+
+
+def install_openapi_components(app: FastAPI, views: list):
+    """
+    Add the nested models referenced by negotiated request/response bodies to the app's OpenAPI components.
+    Request bodies are parsed by a dependency, so FastAPI never registers their models itself.
+    """
+    generate_openapi = app.openapi
+
+    def openapi() -> dict:
+        if app.openapi_schema:  return app.openapi_schema
+        openapi_schema = generate_openapi()
+        schemas = openapi_schema.setdefault("components", {}).setdefault("schemas", {})
+        for view in views:
+            for name, definition in view.openapi_components.items():
+                schemas.setdefault(name, definition)
+        return openapi_schema
+
+    app.openapi = openapi
+
+
+def get_body_parser(schema: Type[BaseModel], parsers: List[BaseParser]):
+    """
+    Build a dependency that decodes the request body according to its `Content-Type`
+    and validates it against the given schema.
+    """
+    async def parse_body(request: Request) -> BaseModel:
+        parser = select_parser(parsers, request.headers.get("content-type"))
+        try:
+            data = parser.parse(await request.body())
+        except Exception:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Malformed request body.")
+        try:
+            return schema.model_validate(data)
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)])
+    return parse_body
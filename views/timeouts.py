@@ -0,0 +1,45 @@
+import asyncio
+from contextlib import suppress
+from typing import Awaitable, TypeVar
+
+from fastapi import Request
+from sqlalchemy.exc import DBAPIError
+
+from config import setting
+
+T = TypeVar("T")
+
+#Raised by Postgres for both statement_timeout and explicit query cancellation
+QUERY_CANCELED = "57014"
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def is_statement_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == QUERY_CANCELED
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it if the client goes away in the meantime.
+
+    Cancelling an in-flight asyncpg query sends a cancel request to the server,
+    so the statement stops instead of holding its pooled connection.
+    """
+    #Buffer the body first; polling for a disconnect consumes receive() messages
+    await request.body()
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=setting.DISCONNECT_POLL_SECONDS)
+            if done:  return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+                raise ClientDisconnected()
+    finally:
+        #The request itself was cancelled (e.g. server shutdown)
+        if not task.done():  task.cancel()